@@ -1,10 +1,23 @@
+import argparse
 import csv
 import re
 import os
+import sys
 import json
-from tkinter import Tk, filedialog
+import locale
+import heapq
+import tempfile
+from collections import defaultdict, deque
 from tabulate import tabulate
-from datetime import datetime
+from itertools import groupby
+from operator import itemgetter
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+    pa_csv = None
 
 def load_config(config_path="config.json"):
     if not os.path.exists(config_path):
@@ -25,115 +38,342 @@ DEFAULT_DIVIDEND_ACCOUNT = config.get("dividend_account", "Income:Dividend Incom
 DEFAULT_FEE_ACCOUNT = config.get("fee_account", "Expenses:Fees and Charges:Financial Charges (Investing)")
 DEFAULT_CONTRIBUTION_ACCOUNT = config.get("contribution_account", "Imbalance-CAD")
 
-def parse_transaction(row, cash_account, dividend_account, fee_account, all_dates):
-    date, ttype, desc, amount = row[:4]
+# Precompiled patterns for parsing the description column
+_SYMBOL_RE = re.compile(r"([\w\.\-]+) -")
+_SHARES_RE = re.compile(r"([\d.]+) shares")
+# Symbol and share count of a trade in a single match
+_TRADE_DESC_RE = re.compile(r"([\w\.\-]+) -(?:.*?([\d.]+) shares)?", re.DOTALL)
+
+# Both readers decode with the same encoding open() would use by default
+_INPUT_ENCODING = locale.getpreferredencoding(False)
+
+# Block size for the pyarrow reader; large blocks mean fewer read calls
+_READ_BLOCK_SIZE = 1 << 24
+
+def _read_rows_pyarrow(path):
+    # Columns are picked by position and kept as plain strings; None means pyarrow
+    # could not read the file (ragged rows, fewer than four columns, ...)
+    try:
+        table = pa_csv.read_csv(
+            path,
+            read_options=pa_csv.ReadOptions(
+                autogenerate_column_names=True,
+                skip_rows=1,
+                block_size=_READ_BLOCK_SIZE,
+                encoding=_INPUT_ENCODING,
+            ),
+            parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+            convert_options=pa_csv.ConvertOptions(
+                column_types={f"f{i}": pa.string() for i in range(4)},
+                include_columns=[f"f{i}" for i in range(4)],
+            ),
+        )
+    except pa.ArrowException:
+        return None
+
+    return (
+        list(row)
+        for batch in table.to_batches()
+        for row in zip(*(column.to_pylist() for column in batch.columns))
+    )
+
+def _read_rows(path):
+    """Yield the data rows of a CSV file, skipping the header."""
+    if pa_csv is not None:
+        rows = _read_rows_pyarrow(path)
+        if rows is not None:
+            yield from rows
+            return
+
+    with open(path, newline='', encoding=_INPUT_ENCODING) as csvfile:
+        reader = csv.reader(csvfile)
+        next(reader, None)  # Skip header
+        yield from reader
+
+def _normalize_symbol(raw_symbol):
+    # Interned since a file repeats a few symbols many times
+    return sys.intern(raw_symbol.split('.', 1)[0].split('-', 1)[0])
+
+def _extract_symbol(desc):
+    symbol_match = _SYMBOL_RE.match(desc)
+    return _normalize_symbol(symbol_match.group(1) if symbol_match else "UNKNOWN")
+
+def _extract_symbol_and_shares(desc):
+    desc_match = _TRADE_DESC_RE.match(desc)
+    if desc_match:
+        raw_symbol, raw_shares = desc_match.groups()
+    else:
+        share_match = _SHARES_RE.search(desc)
+        raw_symbol = "UNKNOWN"
+        raw_shares = share_match.group(1) if share_match else None
+    shares = float(raw_shares) if raw_shares is not None else 0.0
+    return _normalize_symbol(raw_symbol), shares
+
+def _handle_div(date, ttype, desc, amount, cash_account, dividend_account, fee_account, stock_accounts):
+    symbol = _extract_symbol(desc)
+    description = "Dividend " + symbol
+    stock_account = stock_accounts.get(symbol)
+    if stock_account is None:
+        stock_account = stock_accounts[symbol] = cash_account + ":" + symbol
+    return [
+        [date, description, dividend_account, "", "", -amount, "DIV"],   # Credit income
+        [date, description, cash_account, "", "", amount, "CASH"],       # Debit cash
+        [date, description, stock_account, "", "", 0.00, "STOCK"],       # $0 entry in stock register
+    ]
+
+def _handle_fee(date, ttype, desc, amount, cash_account, dividend_account, fee_account, stock_accounts):
+    # The sign of the amount already tells us which way round each entry goes
+    if amount < 0:
+        return [
+            [date, "Investment Fee", fee_account, "", "", -amount, "FEE"],
+            [date, "Investment Fee", cash_account, "", "", amount, "CASH"],
+        ]
+    return [
+        [date, "Fee Rebate", cash_account, "", "", amount, "CASH"],
+        [date, "Fee Rebate", fee_account, "", "", -amount, "FEE"],
+    ]
+
+def _handle_cont(date, ttype, desc, amount, cash_account, dividend_account, fee_account, stock_accounts):
+    abs_amount = -amount if amount < 0 else amount
+    return [
+        [date, "Contribution", cash_account, "", "", abs_amount, "CASH"],
+        [date, "Contribution", DEFAULT_CONTRIBUTION_ACCOUNT, "", "", -abs_amount, "CONT"],
+    ]
+
+def _handle_buy_sell(date, ttype, desc, amount, cash_account, dividend_account, fee_account, stock_accounts):
+    symbol, shares = _extract_symbol_and_shares(desc)
+    description = ttype + " " + symbol
+    stock_account = stock_accounts.get(symbol)
+    if stock_account is None:
+        stock_account = stock_accounts[symbol] = cash_account + ":" + symbol
+    abs_amount = -amount if amount < 0 else amount
+    # Parsed share counts are never negative, so no abs() is needed here
+    price = abs_amount / shares if shares else 0.0
+    if ttype == "SELL":
+        shares = -shares
+        cash_amount = abs_amount
+    else:
+        cash_amount = -abs_amount
+    return [
+        [date, description, stock_account, shares, round(price, 4), abs_amount, ttype],
+        [date, description, cash_account, "", "", cash_amount, "CASH"],
+    ]
+
+# Transaction type -> handler building that transaction's entries
+_HANDLERS = {
+    "DIV": _handle_div,
+    "FEE": _handle_fee,
+    "CONT": _handle_cont,
+    "BUY": _handle_buy_sell,
+    "SELL": _handle_buy_sell,
+}
+
+def parse_transaction(row, cash_account, dividend_account, fee_account, all_dates, stock_accounts=None):
+    # stock_accounts caches symbol -> stock account name; share one dict only
+    # between calls that use the same cash account
+    if stock_accounts is None:
+        stock_accounts = {}
+
+    # Only the first four columns are used; index them rather than slicing the row
+    date = row[0]
+    ttype = row[1]
+    desc = row[2]
+    amount = row[3]
 
     try:
         amount = float(amount)
     except (ValueError, TypeError):
-        print(f"⚠️ Skipping transaction with invalid or missing amount: {row}")
+        print(f"⚠️ Skipping transaction with invalid or missing amount: {row[:4]}")
         return []
     if amount == 0:
-        print(f"⚠️ Skipping {ttype} transaction with $0 amount: {row}")
+        print(f"⚠️ Skipping {ttype} transaction with $0 amount: {row[:4]}")
         return []
 
     all_dates.append(date)
-    entries = []
 
-    # Extract and normalize symbol
-    symbol_match = re.match(r"([\w\.\-]+) -", desc)
-    raw_symbol = symbol_match.group(1) if symbol_match else "UNKNOWN"
-    symbol = re.split(r"[.\-]", raw_symbol)[0]
-    stock_account = f"{cash_account}:{symbol}"
+    handler = _HANDLERS.get(ttype)
+    if handler is None:
+        print(f"⚠️ Unhandled transaction type '{ttype}' on row: {row[:4]}")
+        return []
 
-    if ttype == "DIV":
-        entries.append([date, f"Dividend {symbol}", dividend_account, "", "", -amount, "DIV"])   # Credit income
-        entries.append([date, f"Dividend {symbol}", cash_account, "", "", amount, "CASH"])       # Debit cash
-        entries.append([date, f"Dividend {symbol}", stock_account, "", "", 0.00, "STOCK"])       # $0 entry in stock register
+    return handler(date, ttype, desc, amount, cash_account, dividend_account, fee_account, stock_accounts)
 
+OUTPUT_HEADERS = ["Date", "Description", "Account", "Num.Shares", "Price", "Amount", "Type", "Transaction ID"]
 
-    elif ttype == "FEE":
-        if amount < 0:
-            entries.append([date, "Investment Fee", fee_account, "", "", abs(amount), "FEE"])
-            entries.append([date, "Investment Fee", cash_account, "", "", -abs(amount), "CASH"])
-        else:
-            entries.append([date, "Fee Rebate", cash_account, "", "", abs(amount), "CASH"])
-            entries.append([date, "Fee Rebate", fee_account, "", "", -abs(amount), "FEE"])
+# Largest number of entries echoed to the console in full; larger outputs
+# only show this many entries from each end
+PREVIEW_LIMIT = 200
+PREVIEW_EDGE = 20
 
-    elif ttype == "CONT":
-        entries.append([date, "Contribution", cash_account, "", "", abs(amount), "CASH"])
-        entries.append([date, "Contribution", DEFAULT_CONTRIBUTION_ACCOUNT, "", "", -abs(amount), "CONT"])
+# Zero-padded counters for the common case of fewer than 1000 transactions per date
+_TXN_COUNTERS = [f"{n:03d}" for n in range(1000)]
 
-    elif ttype in ["BUY", "SELL"]:
-        share_match = re.search(r"([\d.]+) shares", desc)
-        shares = float(share_match.group(1)) if share_match else 0.0
-        shares = -shares if ttype == "SELL" else shares
-        price = abs(amount) / abs(shares) if shares else 0.0
+def _txn_id(date, counter):
+    if counter < 1000:
+        return "TRX-" + date + "-" + _TXN_COUNTERS[counter]
+    return f"TRX-{date}-{counter:03d}"
 
-        entries.append([date, f"{ttype} {symbol}", stock_account, shares, round(price, 4), abs(amount), ttype])
+# Output buffering and how many entries are handed to the csv writer at once
+_WRITE_BUFFER_SIZE = 1 << 20
+_WRITE_BATCH_SIZE = 10_000
 
-        cash_amount = -abs(amount) if ttype == "BUY" else abs(amount)
-        entries.append([date, f"{ttype} {symbol}", cash_account, "", "", cash_amount, "CASH"])
+def _current_umask():
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
 
-    else:
-        print(f"⚠️ Unhandled transaction type '{ttype}' on row: {row}")
+def _sort_output_by_date(path, txn_read_order):
+    # Only needed when the inputs were not already in date order. Transactions are
+    # sorted by date and then by the order they were read in, and renumbered to match.
+    with open(path, newline='', buffering=_WRITE_BUFFER_SIZE) as csvfile:
+        reader = csv.reader(csvfile)
+        header = next(reader)
+        # A transaction's entries are written together and share its ID
+        transactions = [list(txn_rows) for _, txn_rows in groupby(reader, key=itemgetter(-1))]
+
+    order = sorted(range(len(transactions)), key=lambda i: (transactions[i][0][0], txn_read_order[i]))
 
-    return entries
+    rows = []
+    txn_counter_per_date = defaultdict(int)
+    for i in order:
+        txn_rows = transactions[i]
+        date = txn_rows[0][0]
+        counter = txn_counter_per_date[date] + 1
+        txn_counter_per_date[date] = counter
+        txn_id = _txn_id(date, counter)
+        for row in txn_rows:
+            row[-1] = txn_id
+        rows.extend(txn_rows)
+
+    with open(path, 'w', newline='', buffering=_WRITE_BUFFER_SIZE) as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+    return rows
+
+def _iter_transactions(file_index, file, cash_account, dividend_account, fee_account, all_dates, stock_accounts):
+    # Lazily yields the entries of each transaction in one input file, along with
+    # where it was read from
+    txn_index = 0
+    for row in _read_rows(file):
+        if len(row) < 4:
+            print(f"⚠️ Skipping malformed row in {file}: {row}")
+            continue
+        try:
+            txn_entries = parse_transaction(row, cash_account, dividend_account, fee_account, all_dates, stock_accounts)
+        except Exception as e:
+            print(f"❌ Error in {file} on row: {row}\n{e}")
+            continue
+        if txn_entries:
+            yield (file_index, txn_index), txn_entries
+            txn_index += 1
+
+def _merge_transactions(input_files, cash_account, dividend_account, fee_account, all_dates, stock_accounts):
+    # Exports are normally in date order already, so merging the files keeps the
+    # output sorted without buffering it; ties keep the order the files were given in
+    return heapq.merge(
+        *(
+            _iter_transactions(file_index, file, cash_account, dividend_account, fee_account, all_dates, stock_accounts)
+            for file_index, file in enumerate(input_files)
+        ),
+        key=lambda txn: txn[1][0][0],
+    )
 
 def convert_multiple_csvs(input_files, output_dir, cash_account, dividend_account, fee_account):
-    all_entries = []
     all_dates = []
-    txn_counter_per_date = {}
-
-    for file in input_files:
-        with open(file, newline='') as csvfile:
-            reader = csv.reader(csvfile)
-            next(reader)  # Skip header
-            for row in reader:
-                if len(row) < 4:
-                    print(f"⚠️ Skipping malformed row in {file}: {row}")
-                    continue
-                try:
-                    txn_entries = parse_transaction(row[:4], cash_account, dividend_account, fee_account, all_dates)
-                    if txn_entries:
-                        date = txn_entries[0][0]
-                        txn_counter_per_date.setdefault(date, 0)
-                        txn_counter_per_date[date] += 1
-                        txn_id = f"TRX-{date}-{txn_counter_per_date[date]:03d}"
-
-                        for entry in txn_entries:
-                            all_entries.append(entry + [txn_id])
-                except Exception as e:
-                    print(f"❌ Error in {file} on row: {row}\n{e}")
-
-    if not all_entries:
-        print("❌ No transactions found.")
-        return
+    stock_accounts = {}
+    txn_counter_per_date = defaultdict(int)
+    preview = []
+    preview_tail = deque(maxlen=PREVIEW_EDGE)
+    entry_count = 0
+    last_date = ""
+    in_date_order = True
+    txn_read_order = []
+
+    # Entries are written out as they are parsed; the final name depends on the date range.
+    # Inputs that were not in date order are re-sorted once everything has been written.
+    fd, temp_path = tempfile.mkstemp(suffix=".csv", dir=output_dir)
+    try:
+        # mkstemp creates the file as 0600; give the output the usual permissions
+        os.chmod(temp_path, 0o666 & ~_current_umask())
+        with os.fdopen(fd, 'w', newline='', buffering=_WRITE_BUFFER_SIZE) as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow(OUTPUT_HEADERS)
+            batch = []
 
-    all_entries.sort(key=lambda x: x[0])  # Sort by date
-    all_dates.sort()
-    start_date = datetime.strptime(all_dates[0], "%Y-%m-%d").date()
-    end_date = datetime.strptime(all_dates[-1], "%Y-%m-%d").date()
-    output_filename = f"gnucash_{start_date}_to_{end_date}.csv"
-    output_path = os.path.join(output_dir, output_filename)
+            for read_order, txn_entries in _merge_transactions(input_files, cash_account, dividend_account, fee_account, all_dates, stock_accounts):
+                txn_read_order.append(read_order)
+                date = txn_entries[0][0]
+                counter = txn_counter_per_date[date] + 1
+                txn_counter_per_date[date] = counter
+                txn_id = _txn_id(date, counter)
 
-    with open(output_path, 'w', newline='') as csvfile:
-        writer = csv.writer(csvfile)
-        writer.writerow(["Date", "Description", "Account", "Num.Shares", "Price", "Amount", "Type", "Transaction ID"])
-        writer.writerows(all_entries)
+                if date < last_date:
+                    in_date_order = False
+                last_date = date
+
+                for entry in txn_entries:
+                    entry.append(txn_id)
+                    batch.append(entry)
+                    entry_count += 1
+                    if entry_count <= PREVIEW_LIMIT:
+                        preview.append(entry)
+                    preview_tail.append(entry)
+
+                if len(batch) >= _WRITE_BATCH_SIZE:
+                    writer.writerows(batch)
+                    batch.clear()
+
+            writer.writerows(batch)
+
+        if not entry_count:
+            print("❌ No transactions found.")
+            return
+
+        if not in_date_order:
+            rows = _sort_output_by_date(temp_path, txn_read_order)
+            preview = rows[:PREVIEW_LIMIT]
+            preview_tail = rows[-PREVIEW_EDGE:]
+
+        # ISO dates compare the same as strings, so no parsing is needed
+        start_date = min(all_dates)
+        end_date = max(all_dates)
+        output_filename = f"gnucash_{start_date}_to_{end_date}.csv"
+        output_path = os.path.join(output_dir, output_filename)
+
+        os.replace(temp_path, output_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
 
     print("\nConverted Transactions:")
-    print(tabulate(all_entries, headers=["Date", "Description", "Account", "Num.Shares", "Price", "Amount", "Type", "Transaction ID"], tablefmt="grid"))
+    if entry_count > PREVIEW_LIMIT:
+        # A full grid is built in memory, so only show both ends of large outputs
+        skipped = entry_count - 2 * PREVIEW_EDGE
+        preview = preview[:PREVIEW_EDGE] + [[f"... {skipped} more rows ..."]] + list(preview_tail)
+    print(tabulate(preview, headers=OUTPUT_HEADERS, tablefmt="grid"))
     print(f"\n✅ Saved to:\n{output_path}")
 
-def main():
+def select_input_files():
+    # Tkinter is only loaded when the file picker is actually needed
+    from tkinter import Tk, filedialog
+
     root = Tk()
     root.withdraw()
 
-    input_paths = filedialog.askopenfilenames(
+    return filedialog.askopenfilenames(
         title="Select Input CSV Files",
         filetypes=[("CSV files", "*.csv")]
     )
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert Wealthsimple CSV exports into a GnuCash import CSV.")
+    parser.add_argument("input_files", nargs="*", help="CSV files to convert (a file picker opens if none are given)")
+    parser.add_argument("-o", "--output-dir", help="directory for the converted file (default: folder of the first input)")
+    args = parser.parse_args()
+
+    input_paths = args.input_files or select_input_files()
     if not input_paths:
         print("❌ No files selected.")
         return
@@ -147,7 +387,8 @@ def main():
     user_fee = input(f"Enter your investment fee account [default: {DEFAULT_FEE_ACCOUNT}]: ").strip()
     fee_account = user_fee if user_fee else DEFAULT_FEE_ACCOUNT
 
-    convert_multiple_csvs(input_paths, os.path.dirname(input_paths[0]), cash_account, dividend_account, fee_account)
+    output_dir = args.output_dir or os.path.dirname(input_paths[0])
+    convert_multiple_csvs(input_paths, output_dir, cash_account, dividend_account, fee_account)
 
 if __name__ == "__main__":
     main()